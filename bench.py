@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+pyFLA benchmarks
+
+Generates synthetic .fla files (see pyfla.synthetic) and times every public
+operation on them. Each operation runs on its own forked process, reporting
+wall time, peak RSS of that process and the number of files written.
+
+    $ python bench.py --symbols 5000 --depth 3 --fanout 4 --chain 5
+"""
+
+import os, sys
+import argparse
+import multiprocessing
+import resource
+import shutil
+import tempfile
+import time
+
+from pyfla import FLA
+from pyfla.synthetic import generate
+
+
+def _count_files(path):
+    return sum(len(files) for parent, dirs, files in os.walk(path))
+
+def _measure(setup, run, workdir, conn):
+    # Child process: run setup (not timed) and then the benchmarked operation
+    tempfile.tempdir = workdir
+    state = setup()
+    before = _count_files(workdir)
+    start = time.time()
+    result = run(state)
+    elapsed = time.time() - start
+
+    # Count files while the resulting objects are alive (FLA working
+    # directories are removed when they are collected)
+    written = _count_files(workdir) - before
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    conn.send((elapsed, rss, written))
+    del result, state
+
+def measure(setup, run, workdir):
+    """
+    Run given operation on a new process, returns (seconds, peak RSS in MB,
+    files written)
+    """
+    os.makedirs(workdir)
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=_measure,
+                                   args=(setup, run, workdir, child))
+    proc.start()
+    try:
+        return parent.recv()
+    finally:
+        proc.join()
+        shutil.rmtree(workdir, True)
+
+def _save(fla):
+    # Save inside the process working directory, to be counted
+    fla.save(os.path.join(tempfile.gettempdir(), 'Output.fla'))
+
+def operations(first, second, workers):
+    # Benchmarks as (name, setup, run)
+    nothing = lambda: None
+    opened = lambda: (FLA.fromfile(first, extract=False, lazy=True),
+                      FLA.fromfile(second, extract=False, lazy=True))
+    loaded = lambda: (FLA.fromfile(first), FLA.fromfile(second))
+
+    def roots(flas):
+        exported = [name for name, symbol in flas[0].symbols.iteritems() \
+                        if symbol.linkage]
+        return flas[0].extract(exported[:5])
+
+    return [
+        ('fromfile', nothing, lambda s: FLA.fromfile(first)),
+        ('fromfile lazy', nothing, lambda s: FLA.fromfile(first, lazy=True)),
+        ('fromfile zip', nothing,
+            lambda s: FLA.fromfile(first, extract=False, lazy=True)),
+        ('fromfile scan', nothing,
+            lambda s: FLA.fromfile(first, extract=False, scan=True)),
+        ('fromfile workers=%d' % workers, nothing,
+            lambda s: FLA.fromfile(first, extract=False, workers=workers)),
+        ('dependencies', loaded, lambda s: s[0].dependencies),
+        ('dependencies scan',
+            lambda: [FLA.fromfile(first, extract=False, scan=True)],
+            lambda s: s[0].dependencies),
+        ('save', loaded, lambda s: _save(s[0])),
+        ('save zip', opened, lambda s: _save(s[0])),
+        ('__add__', loaded, lambda s: s[0] + s[1]),
+        ('__add__ zip', opened, lambda s: s[0] + s[1]),
+        ('merge', nothing, lambda s: FLA.merge([first, second])),
+        ('merge zip', nothing,
+            lambda s: FLA.merge([first, second], extract=False, lazy=True)),
+        ('merge + save zip', opened,
+            lambda s: _save(FLA.merge(s))),
+        ('extract', opened, roots),
+    ]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--symbols', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=3,
+                        help='library folders depth')
+    parser.add_argument('--fanout', type=int, default=3,
+                        help='instances placed by each symbol')
+    parser.add_argument('--chain', type=int, default=4,
+                        help='dependencies depth')
+    parser.add_argument('--layers', type=int, default=1)
+    parser.add_argument('--unicode', action='store_true',
+                        help='use unicode symbol file names')
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--only', help='run operations containing this')
+    parser.add_argument('--output', help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='pyfla-bench-')
+    try:
+        first, second = '%s/First.fla' % tmp, '%s/Second.fla' % tmp
+        for path, prefix in ((first, ''), (second, 'B')):
+            generate(path, symbols=args.symbols, depth=args.depth,
+                     fanout=args.fanout, chain=args.chain,
+                     unicode_names=args.unicode, layers=args.layers,
+                     prefix=prefix)
+
+        lines = ['pyFLA benchmarks: %d symbols, depth=%d fanout=%d chain=%d '
+                 '(%.1f MB archive)' % (args.symbols, args.depth, args.fanout,
+                 args.chain, os.path.getsize(first) / 1048576.0),
+                 '%-24s %10s %12s %8s' % ('operation', 'wall (s)',
+                                          'peak RSS (MB)', 'files')]
+        print '\n'.join(lines)
+
+        for i, (name, setup, run) in enumerate(operations(first, second,
+                                                          args.workers)):
+            if args.only and args.only not in name:
+                continue
+
+            elapsed, rss, written = measure(setup, run, '%s/work%d' % (tmp, i))
+            lines.append('%-24s %10.3f %12.1f %8d' % (name, elapsed, rss,
+                                                      written))
+            print lines[-1]
+            sys.stdout.flush()
+
+        if args.output:
+            open(args.output, 'w').write('\n'.join(lines) + '\n')
+    finally:
+        shutil.rmtree(tmp, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,16 +9,24 @@ Merge Flash CS5 .FLA files, joining library objects
 >>> fla.save('Merged.fla')
 """
 
-import glob
+import multiprocessing
 import re
 import sys, os
 import shutil
 import tempfile
-from hashlib import md5
-from odict import OrderedDict
-from xml.etree.cElementTree import fromstring
-
-from fileoperations import fzip, funzip, fixencoding
+import zipfile
+from cStringIO import StringIO
+from hashlib import sha1
+from xml.sax.saxutils import escape, quoteattr, unescape
+from xml.etree.cElementTree import fromstring, iterparse
+
+from fileoperations import fzip, fxfl, funzip, fclone, fwrite, seekable, \
+                           namekey, PathIndex, ZipArchive, DirectoryArchive
+from graph import closures, components, reachable
+from cache import ParseCache
+from folders import Folders
+from instances import InstanceTable
+from stats import NULL_STATS
 
 # Get current script directory and append template path
 TPL_PATH = os.path.dirname(os.path.realpath(__file__)) + '/templates'
@@ -30,26 +38,177 @@ class InvalidFLAFile(Exception):
     """
 
 
+class SymbolConflict(Exception):
+    """
+    This exception is raised when merging FLA files defining the same symbol
+    using the 'error' conflict policy
+    """
+
+
 def _unicode(val):
     # Decode string as needed checking if this is already decoded
     return unicode(val, 'utf-8') if isinstance(val, str) else val
 
-def _fix_insensitive_path(path):
+def _intern(names, val):
+    # Decoded string shared by every equal value in names, the table of a
+    # loaded FLA (intern() does not support unicode), used for the few
+    # instance, layer and timeline names repeated all over
+    val = _unicode(val)
+    return names.setdefault(val, val)
+
+def _fix_paths(index, paths):
     # Some files could have an incorrect path information on case-insensitive
-    # FS. This could cause lost of some symbols. This fix the case.
-    bpath = os.path.basename(path)
-    ipath = bpath.lower()
-    for f in glob.glob("%s/../*" % path):
-        base = os.path.basename(f)
-        if ipath == base.lower() and base != bpath:
-            shutil.move(f, path + 'temp')
-            shutil.move(path + 'temp', path)
-            return
+    # FS or a different unicode normalization (unzip is setting the encoding
+    # wrong). This could cause lost of some symbols. Given paths (relative to
+    # index root) are looked up in the index and renamed in a single batch.
+    # Paths are compared and renamed as utf-8 strings, as walked on disk
+    renames = []
+    for path in paths:
+        actual = index.resolve(path)
+        path = _unicode(path).encode('utf-8')
+        if actual is not None and actual != path:
+            renames.append((actual, path))
+
+    if not renames:
+        return index
+
+    # Rename parents first, then children are found under its fixed path
+    moved = {}
+    renames.sort(key=lambda (actual, path): path.count('/'))
+    for actual, path in renames:
+        prefix = current = ''
+        for name in actual.split('/'):
+            prefix = os.path.join(prefix, name)
+            current = moved.get(prefix, os.path.join(current, name))
+
+        if current == path:
+            # Already fixed renaming its parent
+            continue
+
+        src = os.path.join(index.root, current)
+        dst = os.path.join(index.root, path)
+        os.rename(src, dst + 'temp')
+        os.rename(dst + 'temp', dst)
+        moved[actual] = path
+
+    return PathIndex(index.root)
+
+def _scan_dom(dom):
+    # Get symbol root attributes and a list of instances references as
+    # (libraryItemName, name, frame index, layer, timeline) tuples
+    ns = dom.attrib['xmlns']
+    refs = []
+    for ttimeline in dom.getiterator("{%s}DOMTimeline" % ns):
+        for tlayer in ttimeline.getiterator("{%s}DOMLayer" % ns):
+            for tframe in tlayer.getiterator("{%s}DOMFrame" % ns):
+                tagname = "{%s}DOMSymbolInstance" % ns
+                for tsymb in tframe.getiterator(tagname):
+                    refs.append((tsymb.attrib['libraryItemName'],
+                                 tsymb.attrib.get('name', u''),
+                                 tframe.attrib['index'],
+                                 tlayer.attrib['name'],
+                                 ttimeline.attrib['name']))
+
+    return dom.attrib, refs
+
+def _iterscan(fileobj):
+    # Streaming version of _scan_dom, elements are dropped as soon as they are
+    # parsed so no tree is kept in memory
+    attrib, refs = None, []
+    timelines, layers, frames, stack = [], [], [], []
+    for event, elem in iterparse(fileobj, events=('start', 'end')):
+        if event == 'end':
+            stack.pop()
+            if stack:
+                stack[-1].remove(elem)
+
+            if elem.tag == tagtimeline:
+                timelines.pop()
+            elif elem.tag == taglayer:
+                layers.pop()
+            elif elem.tag == tagframe:
+                frames.pop()
+
+            elem.clear()
+            continue
+
+        stack.append(elem)
+        if attrib is None:
+            attrib = dict(elem.attrib)
+            attrib['xmlns'] = ns = elem.tag.split('}')[0][1:]
+            tagtimeline = "{%s}DOMTimeline" % ns
+            taglayer = "{%s}DOMLayer" % ns
+            tagframe = "{%s}DOMFrame" % ns
+            tagsymbol = "{%s}DOMSymbolInstance" % ns
+        elif elem.tag == tagtimeline:
+            timelines.append(elem.attrib['name'])
+        elif elem.tag == taglayer:
+            layers.append(elem.attrib['name'])
+        elif elem.tag == tagframe:
+            frames.append(elem.attrib['index'])
+        elif elem.tag == tagsymbol and frames and layers and timelines:
+            refs.append((elem.attrib['libraryItemName'],
+                         elem.attrib.get('name', u''),
+                         frames[-1], layers[-1], timelines[-1]))
+
+    return attrib, refs
+
+def _parse_symbol(xml):
+    dom = fromstring(xml)
+    dom.attrib['xmlns'] = dom.tag.split('}')[0][1:]
+    return dom
+
+_archives = {}
+def _scan_symbol(job, archive=None):
+    # Scan a symbol XML returning its metadata (or None if the file does not
+    # exist). Pool workers open archives once per process.
+    path, filename, member = job
+    if filename is not None:
+        if archive is None:
+            if filename not in _archives:
+                _archives[filename] = ZipArchive(filename)
+
+            archive = _archives[filename]
+
+        if member not in archive:
+            return None
+
+        return _iterscan(archive.open(member))
+
+    try:
+        return _iterscan(open(path))
+    except IOError:
+        return None
+
+def _symbol_name(symbol):
+    # Library name of given Symbol object (Names are returned as they are)
+    if isinstance(symbol, basestring):
+        return symbol
+
+    return symbol.attrs['href'][:-4]
+
+def _file_name(filepath):
+    # FLA name of a file path or file object (None for unnamed streams, as
+    # "<socket>" or "<stdin>")
+    if not isinstance(filepath, basestring):
+        filepath = getattr(filepath, 'name', None)
+        if not isinstance(filepath, basestring) or filepath.startswith('<'):
+            return None
+
+    return os.path.basename(filepath).split('.')[0]
 
 def _tag_from_dict(tag, attrs, terminate=True):
-    attrs = ''.join('%s="%s" ' % (k, v.replace('&', '&amp;')) \
+    attrs = u''.join(u'%s="%s" ' % (k, escape(_unicode(v), ATTR_ENTITIES)) \
                         for k, v in attrs.iteritems())
-    return u'<%s %s%s>' % (tag, _unicode(attrs), '/' if terminate else '')
+    return u'<%s %s%s>' % (tag, attrs, '/' if terminate else '')
+
+def _lines(tags):
+    # Same as u'\n'.join(tags), one piece at a time
+    for i, tag in enumerate(tags):
+        yield u'\n%s' % tag if i else tag
+
+ATTR_ENTITIES = {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}
+TEMPLATE_KEY = re.compile(r'\{\{ (\w+) \}\}')
 
 
 class FLA(object):
@@ -61,7 +220,14 @@ class FLA(object):
 
     def __init__(self, **kwargs):
         self.symbols = {}
-        self.folders = OrderedDict()
+        self.folders = Folders()
+        self.archive = None
+        self.index = None
+        self.stats = NULL_STATS
+        self._usages = None
+        self._table = None
+        self._pruned = set()
+        self._names = {}
         self.directory = kwargs.get('directory') or tempfile.mkdtemp()
 
         # Load default configuration
@@ -86,129 +252,375 @@ class FLA(object):
         shutil.rmtree(self.directory)
 
     @classmethod
-    def fromfile(klass, filepath):
+    def fromfile(klass, filepath, lazy=False, extract=True, workers=None,
+                 scan=False, cache=None, stats=None, compact=False):
         """
         Creates a new FLA object parsing given file (full path please)
+
+        When lazy is True symbols XML are not parsed until their dom,
+        linkage, dependencies or instances are requested. When extract is
+        False files are read straight from the zip archive and only written
+        to the working directory once they are modified.
+
+        When scan is True linkage and instances are pulled out of symbols
+        XML using a streaming parser, without building its dom. Symbols could
+        also be scanned using a pool of given number of worker processes.
+        In both cases their dom is parsed only if requested. When compact is
+        True symbols dom is dropped once linkage and instances are pulled
+        out of it (and parsed again if requested).
+
+        Given a cache directory (or ParseCache), symbols metadata is stored
+        there and not scanned again while their zip member is unchanged.
+
+        Per-phase timing and counters are recorded in stats (see
+        pyfla.stats.Stats), which is kept as the FLA stats.
         """
         _dir = tempfile.mkdtemp()
+        archive = None
+        stats = stats or NULL_STATS
+
+        if not extract:
+            with stats.phase('open') as record:
+                try:
+                    archive = ZipArchive(filepath)
+                    record['items'] = len(archive.members)
+                except (zipfile.BadZipfile, IOError):
+                    # Let the extraction fallback deal with broken archives
+                    archive = None
+
+        if archive is None:
+            with stats.phase('unzip') as record:
+                record['items'] = funzip(filepath, _dir, workers)
+                if record['items']:
+                    record['bytes'] = os.path.getsize(filepath)
+
+        return klass._load(filepath, os.path.basename(filepath).split('.')[0],
+                           _dir, archive, lazy, workers, scan, cache, stats,
+                           compact)
+
+    @classmethod
+    def fromfileobj(klass, fileobj, name=None, lazy=False, scan=False,
+                    cache=None, stats=None, compact=False):
+        """
+        Creates a new FLA object from a .fla file object (see fromfile for
+        the other arguments), read in memory: nothing is extracted to disk.
+        Non seekable streams (sockets, requests) are read whole first.
+
+        Its name is taken from the file object name unless given.
+        """
+        if name is None:
+            name = _file_name(fileobj) or 'dynamic'
+
+        stats = stats or NULL_STATS
+        with stats.phase('open') as record:
+            if not seekable(fileobj):
+                fileobj = StringIO(fileobj.read())
+
+            try:
+                archive = ZipArchive(fileobj)
+            except zipfile.BadZipfile:
+                raise InvalidFLAFile("%s is not a valid Flash CS5 file" % name)
+
+            record['items'] = len(archive.members)
+
+        return klass._load(name, name, tempfile.mkdtemp(), archive, lazy,
+                           None, scan, cache, stats, compact)
+
+    @classmethod
+    def frombytes(klass, data, name='dynamic', **kwargs):
+        """
+        Creates a new FLA object from .fla file contents (see fromfileobj)
+        """
+        return klass.fromfileobj(StringIO(data), name, **kwargs)
+
+    @classmethod
+    def fromdirectory(klass, path, lazy=False, workers=None, scan=False,
+                      cache=None, stats=None, compact=False):
+        """
+        Creates a new FLA object from an uncompressed XFL directory (or its
+        .xfl file), see fromfile for the other arguments.
+
+        The directory is used in place and never modified: files are read
+        from it and only written to the working directory once they are
+        modified (the same as fromfile with extract=False).
+        """
+        if os.path.isfile(path):
+            path = os.path.dirname(path)
+
+        path = os.path.normpath(path)
+        stats = stats or NULL_STATS
+        with stats.phase('open') as record:
+            archive = DirectoryArchive(path)
+            record['items'] = len(archive.members)
 
-        funzip(filepath, _dir)
-        
-        if not os.path.isfile('%s/DOMDocument.xml' % _dir):
+        return klass._load(path, os.path.basename(path), tempfile.mkdtemp(),
+                           archive, lazy, workers, scan, cache, stats,
+                           compact)
+
+    @classmethod
+    def _load(klass, filepath, name, _dir, archive, lazy, workers, scan,
+              cache, stats, compact):
+        # Load a FLA from its archive (ZipArchive or DirectoryArchive) or
+        # from its files extracted into _dir
+        if archive is not None and 'DOMDocument.xml' in archive:
+            xml = archive.read('DOMDocument.xml')
+        elif os.path.isfile('%s/DOMDocument.xml' % _dir):
+            xml = open('%s/DOMDocument.xml' % _dir).read()
+        else:
+            shutil.rmtree(_dir, True)
             raise InvalidFLAFile("%s is not a valid Flash CS5 file" % filepath)
 
         # Parse XML file
-        xml = open('%s/DOMDocument.xml' % _dir).read()
         dom = fromstring(xml)
         xmlns = dom.tag.split('}')[0][1:] if dom.tag.startswith('{') else ''
 
         # Parse all library folders
-        fla = FLA(name=os.path.basename(filepath).split('.')[0], 
-                  directory=_dir)
+        fla = FLA(name=name, directory=_dir, archive=archive, stats=stats)
 
         domfolders = dom.find("{%s}folders" % xmlns)
         if domfolders is not None:
             for folder in domfolders.getchildren():
-                path = folder.attrib['name']
-                uid = md5(path.encode('utf-8')).hexdigest()
-                _fix_insensitive_path(os.path.join(_dir, 'LIBRARY', path))
-
-                fla.folders[path] = {
-                    'name': path,
-                    'itemID': "0000%s-0000%s" % (uid[:4], uid[4:8])
-                }
+                fla.folders.add(folder.attrib['name'])
 
         # Parse all library symbols
         domsymbols = dom.find("{%s}symbols" % xmlns)
+        if archive is None:
+            hrefs = [] if domsymbols is None else \
+                    [symbol.attrib['href'] for symbol in domsymbols]
+            paths = [u'LIBRARY/%s' % path \
+                         for path in fla.folders.keys() + hrefs]
+            with stats.phase('fix_paths') as record:
+                fla.index = _fix_paths(PathIndex(_dir), paths)
+                record['items'] = len(paths)
+
         if domsymbols is not None:
             childs = domsymbols.getchildren()
-            for symbol in childs:
-                name = symbol.attrib['href'][:-4]
-                try:
-                    fla.symbols[name] = Symbol(symbol.attrib, fla.symbols,
-                                               fla.directory)
-                except IOError:
-                    # In some scenarios, there is referenced symbols that 
-                    # doesn't exists on directory.
-                    continue
+            metas = [None] * len(childs)
+            scanned = bool(workers and workers > 1 or cache)
+            if cache:
+                if not isinstance(cache, ParseCache):
+                    cache = ParseCache(cache)
+
+                with stats.phase('cache') as record:
+                    keys, metas = klass._cached_symbols(childs, filepath,
+                                                        archive, cache)
+                    record['items'] = len(metas) - metas.count(None)
+
+            if scanned:
+                missing = [i for i, meta in enumerate(metas) if meta is None]
+                tags = [childs[i] for i in missing]
+                with stats.phase('scan') as record:
+                    scans = klass._scan_symbols(tags, _dir, archive, workers)
+                    record['items'] = len(tags)
+
+                for i, meta in zip(missing, scans):
+                    metas[i] = meta
+                    if cache and meta is not None and keys[i] is not None:
+                        cache.set(keys[i][0], keys[i][1], meta)
+
+                if cache:
+                    cache.commit()
+
+            with stats.phase('symbols') as record:
+                for symbol, meta in zip(childs, metas):
+                    name = symbol.attrib['href'][:-4]
+                    if scanned and meta is None:
+                        continue
+
+                    try:
+                        fla.symbols[name] = Symbol(symbol.attrib, fla.symbols,
+                                                   fla.directory, lazy=lazy,
+                                                   archive=archive, meta=meta,
+                                                   scan=scan, compact=compact,
+                                                   names=fla._names)
+                    except IOError:
+                        # In some scenarios, there is referenced symbols that
+                        # doesn't exists on directory.
+                        continue
+
+                record['items'] = len(fla.symbols)
 
         return fla
 
+    @staticmethod
+    def _scan_symbols(tags, directory, archive, workers):
+        # Read and scan symbols XML files, using a pool of processes if
+        # more than one worker is requested
+        filename = archive.filename if archive is not None else None
+        jobs = [("%s/LIBRARY/%s" % (directory, tag.attrib['href']), filename,
+                 "LIBRARY/%s" % tag.attrib['href']) for tag in tags]
+
+        if isinstance(archive, DirectoryArchive):
+            # Directories files are read in place, as extracted files
+            jobs = [(archive.path(job[2]) or '', None, job[2]) for job in jobs]
+            archive = None
+
+        if not workers or workers < 2:
+            return [_scan_symbol(job, archive) for job in jobs]
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunksize = max(1, len(jobs) / (workers * 4))
+            return pool.map(_scan_symbol, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def _cached_symbols(tags, filepath, archive, cache):
+        # Get (crc, size) keys and cached metadata (or None) of given symbols
+        try:
+            infos = archive or ZipArchive(filepath)
+        except (zipfile.BadZipfile, IOError):
+            return [None] * len(tags), [None] * len(tags)
+
+        keys, metas = [], []
+        for tag in tags:
+            member = "LIBRARY/%s" % tag.attrib['href']
+            if member not in infos:
+                keys.append(None)
+                metas.append(None)
+                continue
+
+            key = (infos.crc(member), infos.getinfo(member).file_size)
+            keys.append(key)
+            metas.append(cache.get(*key))
+
+        return keys, metas
+
     def __str__(self):
         # Visualization candy
         return "<FLA '%s' symbols=%d folders=%d>" % \
                 (self.name, len(self.symbols), len(self.folders))
     
-    def _replace_template(self, tpl, values):
-        # Replace into given template (string) some dinamic values 
-        for k, v in values.iteritems():
-            if isinstance(v, unicode):
-                v = v.encode('utf-8')
+    def _render(self, tpl, values):
+        # Yield given template pieces (utf-8 strings) replacing its keys by
+        # values[key], strings or iterables of strings, or by this FLA
+        # string or number attributes. Other keys are left as they are.
+        for i, piece in enumerate(TEMPLATE_KEY.split(tpl)):
+            if i % 2 == 0:
+                yield piece
+                continue
+
+            value = values[piece] if piece in values \
+                        else getattr(self, piece, None)
+            if isinstance(value, (int, long, float)):
+                value = str(value)
+
+            if value is None:
+                yield '{{ %s }}' % piece
+            elif isinstance(value, basestring):
+                yield _unicode(value).encode('utf-8')
+            else:
+                for chunk in value:
+                    yield chunk.encode('utf-8')
+
+    def _document(self):
+        # DOMDocument.xml pieces, one tag at a time
+        folders = (_tag_from_dict('DOMFolderItem', folder) \
+                       for folder in self.folders.itervalues())
 
-            if isinstance(v, str):
-                tpl = tpl.replace("{{ %s }}" % k, v)
+        # Sort Items, to avoid some Flash Crashes (!!!)
+        hrefs = sorted((symbol.attrs['href'], name) \
+                           for name, symbol in self.symbols.iteritems())
+        symbols = (self.symbols[name].to_xml() for href, name in hrefs)
+
+        return self._render(self.xdom, {'folders_xml': _lines(folders),
+                                        'symbols_xml': _lines(symbols)})
 
-        return tpl
+    def _generated(self):
+        # Files generated when saving, as (arcname, chunks)
+        return [('mimetype', [self.mimetype]),
+                ('DOMDocument.xml', self._document()),
+                ('PublishSettings.xml', self._render(self.xconf, {})),
+                ('%s.xfl' % self.name, ['PROXY-CS5'])]
 
-    def save(self, filepath):
+    def save(self, filepath, level=None, workers=None):
         """
         Read our not_saved record, craft xml, zip and save into given filepath
-        """
-        self.name = os.path.basename(filepath).split('.')[0]
+        (or file object, which could be a non seekable stream)
 
-        xmlfolders = u'\n'.join(_tag_from_dict('DOMFolderItem', f)\
-                for f in self.folders.itervalues())
-        
-        # Sort Items, to avoid some Flash Crashes (!!!)
-        symbols = self.symbols.values()
-        symbols.sort(key=lambda x: x.attrs['href'])
-        xmlsymbols = u'\n'.join(s.to_xml() for s in symbols)
-
-        xdom = self._replace_template(self.xdom, 
-                {'folders_xml': xmlfolders, 'symbols_xml': xmlsymbols})
-        xconf = self._replace_template(self.xconf, 
-                dict((k, getattr(self, k)) for k in dir(self) if k[0] != '_'))
+        DOMDocument.xml and PublishSettings.xml are streamed into the zip
+        while they are generated, so the document is never held in memory.
+        A filepath is written aside and then renamed, so the FLA could be
+        saved over an archive it reads its members from.
 
-        open('%s/mimetype' % self.directory, 'w').write(self.mimetype)
-        open('%s/DOMDocument.xml' % self.directory, 'w').write(xdom)
-        open('%s/PublishSettings.xml' % self.directory, 'w').write(xconf)
-        open('%s/%s.xfl' % (self.directory, self.name), 'w').write('PROXY-CS5')
+        Files are stored (not compressed) unless a zlib compression level is
+        given (1 fastest to 9 best), compressed then using a pool of given
+        number of threads. Members copied from a source archive keep their
+        compression, and media already compressed is always stored.
+        """
+        self.name = _file_name(filepath) or self.name
 
         # Make FLA file (Just a regular zip file)
-        fzip(filepath, self.directory)
+        with self.stats.phase('zip') as record:
+            record['items'] = fzip(filepath, self.directory, self._archived(),
+                                   self.index, self._generated(), level,
+                                   workers)
+            if isinstance(filepath, basestring):
+                record['bytes'] = os.path.getsize(filepath)
+
+    def save_xfl(self, directory):
+        """
+        Save as an uncompressed XFL into given directory (created as needed,
+        files already there are replaced). Its name is the directory name.
+        Files are cloned or hardlinked when possible.
+        """
+        directory = os.path.normpath(directory)
+        self.name = os.path.basename(directory)
+
+        generated = [(name, chunks) for name, chunks in self._generated() \
+                         if name != 'mimetype']
+        with self.stats.phase('xfl') as record:
+            record['items'] = fxfl(directory, self.directory,
+                                   self._archived(), self.index, generated)
+
+    def _archived(self):
+        # Yield (archive, name, arcname) for every member which is still
+        # living inside a source archive (Not extracted nor modified).
+        # Symbols go first, to be saved using its library path case
+        for symbol in self.symbols.itervalues():
+            if symbol.archive is not None:
+                yield symbol.archive, symbol.member, \
+                      'LIBRARY/%s' % symbol.attrs['href']
+
+        if self.archive is not None:
+            for name in self.archive.namelist():
+                if namekey(name) not in self._pruned:
+                    yield self.archive, name, name
 
     @classmethod
     def from_symbols(klass, symbols, fladirectory=None, flainstance=None):
-        paths = lambda n: [] \
-            if n == os.path.dirname(n) else paths(os.path.dirname(n)) + [n]
-
         newfla = flainstance or FLA(name='dynamic')
         newfla.symbols = symbols
+        newfla._usages = newfla._table = None
         if fladirectory:
             newfla.directory = fladirectory
 
-        for ohref, symbol in symbols.items():
-            href = os.path.dirname(symbol.attrs['href'])
+        with newfla.stats.phase('copy') as record:
+            for ohref, symbol in symbols.items():
+                href = os.path.dirname(symbol.attrs['href'])
+
+                # Fill up folders automatically, based on symbols
+                newfla.folders.add(href)
 
-            # Fill up folders automatically, based on symbols
-            for path in paths(href):
-                uid = md5(path.encode('utf-8')).hexdigest()
-                newfla.folders[path] = {
-                    'name': path,
-                    'itemID': "0000%s-0000%s" % (uid[:4], uid[4:8])
-                }
+                name = _unicode(ohref).encode('utf-8')
+                dest_file = "%s/LIBRARY/%s.xml" % (newfla.directory, name)
+                dest_dir = os.path.dirname(dest_file)
 
-            dest_file = "%s/LIBRARY/%s.xml" % (newfla.directory, ohref)
-            dest_dir = os.path.dirname(dest_file)
+                # Archived symbols are copied straight from its zip when
+                # saving, files are cloned or hardlinked when possible
+                if symbol.archive is None and \
+                   os.path.dirname(symbol.xml) != dest_dir:
+                    # Create directory if it does not exists
+                    if not os.path.isdir(dest_dir):
+                        os.makedirs(dest_dir)
 
-            # Create directory if it does not exists
-            if not os.path.isdir(dest_dir):
-                os.makedirs(dest_dir)
+                    fclone(symbol.xml, dest_file)
 
-            if os.path.dirname(symbol.xml) != dest_dir:
-                shutil.copy(symbol.xml, dest_dir)
+                newfla.symbols[ohref].xml = dest_file
 
-            newfla.symbols[ohref].xml = dest_file
+            record['items'] = len(symbols)
 
         return newfla
 
@@ -220,8 +632,52 @@ class FLA(object):
         if not isinstance(other, FLA):
             raise TypeError("You cannot add other than FLA object")
 
-        symbols = dict(self.symbols, **other.symbols)
-        return FLA.from_symbols(symbols)
+        # The merged FLA keeps recording into the operands stats
+        stats = self.stats if self.stats is not NULL_STATS else other.stats
+        return FLA.merge([self, other], stats=stats)
+
+    @classmethod
+    def merge(klass, sources, conflict='last', dedupe=False, **kwargs):
+        """
+        Merge many FLA objects (or file paths, opened using fromfile with
+        given kwargs) into a new FLA. The final set of symbols is planned
+        first, so every symbol file is copied only once.
+
+        Symbols defined more than once are resolved with conflict policy:
+        'last' (default) or 'first' wins, 'error' raises SymbolConflict, or a
+        callable(name, current, other) returning the symbol to keep.
+
+        When dedupe is True symbols with the same content are merged into
+        one (see FLA.dedupe).
+        """
+        if conflict not in ('last', 'first', 'error') and \
+           not callable(conflict):
+            raise ValueError("Unknown conflict policy %r" % (conflict, ))
+
+        # Sources must be alive until their symbols are copied
+        stats = kwargs.get('stats') or NULL_STATS
+        flas = []
+        symbols = {}
+        for source in sources:
+            if not isinstance(source, FLA):
+                source = klass.fromfile(source, **kwargs)
+
+            flas.append(source)
+            for name, symbol in source.symbols.iteritems():
+                if name not in symbols or conflict == 'last':
+                    symbols[name] = symbol
+                elif conflict == 'error':
+                    raise SymbolConflict("Symbol %s is defined more than "
+                                         "once" % name)
+                elif callable(conflict):
+                    symbols[name] = conflict(name, symbols[name], symbol)
+
+        merged = FLA(name='dynamic', stats=stats)
+        merged = klass.from_symbols(symbols, flainstance=merged)
+        if dedupe:
+            merged.dedupe()
+
+        return merged
 
     def append(self, other):
         """
@@ -234,16 +690,305 @@ class FLA(object):
         symbols = dict(self.symbols, **other.symbols)
         return FLA.from_symbols(symbols, self.directory, self)
 
+    def extract(self, names, with_dependencies=True):
+        """
+        Creates a new FLA holding only given symbols (library names, or
+        linkage class names) and, by default, every symbol they depend on.
+
+        Opening the source with fromfile(extract=False, lazy=True) nothing
+        outside the dependency closure is parsed, and symbols are copied
+        straight from the source archive when saved.
+        """
+        roots = self._roots(names)
+        symbols = {}
+        for root in roots:
+            symbols[_symbol_name(root)] = root
+            if with_dependencies:
+                for symbol in root.dependencies:
+                    symbols[_symbol_name(symbol)] = symbol
+
+        return FLA.from_symbols(symbols)
+
+    def _roots(self, names):
+        # Symbols with given library names or linkage class names
+        roots, linkages = [], None
+        for name in names:
+            if name in self.symbols:
+                roots.append(self.symbols[name])
+                continue
+
+            # Linkage names need every symbol linkage to be read
+            if linkages is None:
+                linkages = dict((symbol.linkage, symbol) \
+                    for symbol in self.symbols.itervalues() if symbol.linkage)
+
+            if name not in linkages:
+                raise KeyError("Symbol %s does not exist" % name)
+
+            roots.append(linkages[name])
+
+        return roots
+
+    def prune(self, roots=None):
+        """
+        Remove every symbol not reachable from given roots (library names or
+        linkage class names), by default the symbols exported for
+        actionscript. Folders left without symbols are removed too.
+
+        Returns a report dict: removed symbols names and folders paths, and
+        bytes, the size of the removed symbols XML.
+        """
+        with self.stats.phase('prune') as record:
+            if roots is None:
+                roots = [symbol for symbol in self.symbols.itervalues() \
+                    if symbol._scan()[0].get('linkageExportForAS') == 'true']
+            else:
+                roots = self._roots(roots)
+
+            keep = reachable(roots, Symbol._children)
+            removed = sorted(name for name, symbol in self.symbols.iteritems()
+                                 if symbol not in keep)
+
+            size, dropped = self._drop(removed)
+            record['items'] = len(removed)
+            record['bytes'] = size
+
+        return {'symbols': removed, 'folders': dropped, 'bytes': size}
+
+    def _drop(self, names):
+        # Remove given symbols, its files and the folders left without any
+        # symbol. Returns removed XML size and removed folders.
+        size = 0
+        folders = set()
+        for name in names:
+            symbol = self.symbols.pop(name)
+            if symbol.archive is not None:
+                size += symbol.archive.getinfo(symbol.member).file_size
+            elif os.path.isfile(symbol.xml):
+                size += os.path.getsize(symbol.xml)
+
+            # Neither its file nor its source archive member are saved
+            if os.path.isfile(symbol.xml):
+                os.remove(symbol.xml)
+
+            self._pruned.add(namekey(symbol.member))
+            folders.add(os.path.dirname(symbol.attrs['href']))
+
+        # Folders (and its parents) without any symbol left
+        used = set()
+        for symbol in self.symbols.itervalues():
+            path = os.path.dirname(symbol.attrs['href'])
+            while path and path not in used:
+                used.add(path)
+                path = os.path.dirname(path)
+
+        empty = set()
+        for path in folders:
+            while path and path not in used and path not in empty:
+                empty.add(path)
+                path = os.path.dirname(path)
+
+        dropped = []
+        for path in sorted(empty):
+            if path in self.folders:
+                dropped.extend(self.folders.remove(path))
+
+        return size, sorted(dropped)
+
+    def dedupe(self):
+        """
+        Merge symbols with the same content (XML but its name, itemID,
+        lastModified and timeline name) into one canonical symbol: the first
+        one visited, walking symbols children first and otherwise by library
+        name (so a symbol placed by others is kept over a later duplicate
+        with a lower name). References to duplicates are rewritten to the
+        canonical symbol, which makes their users duplicates too when they
+        only differed on those references. Every symbol XML is read once.
+
+        Returns a report dict: duplicates names -> canonical name, removed
+        folders and bytes, the size of the removed symbols XML.
+        """
+        with self.stats.phase('dedupe') as record:
+            canonical, hashes, rewritten = {}, {}, []
+            def children(name):
+                names = (_refname(ref[0]) for ref in
+                             self.symbols[name]._scan()[1])
+                return [child for child in names if child in self.symbols]
+
+            for component in components(sorted(self.symbols), children):
+                for name in sorted(component):
+                    symbol = self.symbols[name]
+                    xml = symbol._read().decode('utf-8')
+                    newxml = _rename_refs(xml, canonical)
+                    digest = sha1(_normalize_symbol(newxml).encode('utf-8'))
+                    digest = digest.hexdigest()
+                    if digest in hashes:
+                        canonical[name] = hashes[digest]
+                        continue
+
+                    hashes[digest] = name
+                    if newxml != xml:
+                        rewritten.append((symbol, newxml))
+
+            record['items'] = len(self.symbols)
+
+            for symbol, xml in rewritten:
+                if not os.path.isdir(os.path.dirname(symbol.xml)):
+                    os.makedirs(os.path.dirname(symbol.xml))
+
+                fwrite(symbol.xml, xml.encode('utf-8'))
+                symbol.archive = None
+                symbol._symbols = self.symbols
+                symbol._meta = symbol._dom = symbol._instances = None
+
+            size, dropped = self._drop(canonical)
+            for symbol in self.symbols.itervalues():
+                symbol._depcache = None
+
+            record['bytes'] = size
+
+        return {'symbols': canonical, 'folders': dropped, 'bytes': size}
+
+    def _get_dependencies(self):
+        """
+        Dependencies of every symbol (name -> frozenset of Symbol objects),
+        resolved in one pass over the whole library.
+        """
+        with self.stats.phase('dependencies') as record:
+            _resolve(self.symbols.values())
+            record['items'] = len(self.symbols)
+
+        return dict((name, symbol.dependencies) \
+                        for name, symbol in self.symbols.iteritems())
+
+    def _index(self):
+        # Reverse index of instances, filled in the same pass that resolves
+        # every Symbol.instances: symbol name -> placements, users names and
+        # (lazily) transitive users names
+        if self._usages is None or self._usages[0] is not self.symbols or \
+           self._usages[1] != len(self.symbols):
+            placements, users = {}, {}
+            with self.stats.phase('index') as record:
+                for name, symbol in self.symbols.iteritems():
+                    for instance in symbol.instances:
+                        child = instance.symbol.attrs['href'][:-4]
+                        placements.setdefault(child, []).append(instance)
+                        users.setdefault(child, set()).add(name)
+                        record['items'] += 1
+
+            self._usages = (self.symbols, len(self.symbols), placements,
+                            users, {})
+
+        return self._usages[2:]
+
+    def placements(self, symbol):
+        """
+        Instances of given symbol (Symbol object or name) placed in other
+        symbols timelines. Each SymbolInstance parent is the symbol using it.
+        """
+        placements = self._index()[0]
+        return list(placements.get(_symbol_name(symbol), ()))
+
+    def users(self, symbol):
+        """
+        Symbols which directly place an instance of given symbol
+        """
+        users = self._index()[1]
+        names = users.get(_symbol_name(symbol), ())
+        return set(self.symbols[n] for n in names)
+
+    def all_users(self, symbol):
+        """
+        Symbols depending on given symbol, directly or through other symbols.
+        Computed over the reverse graph the first time and then cached.
+        """
+        placements, users, allusers = self._index()
+        name = _symbol_name(symbol)
+        if name not in allusers:
+            parents = lambda n: users.get(n, ())
+            allusers.update(closures([name], parents, allusers.get))
+
+        return set(self.symbols[n] for n in allusers[name])
+
+    def instance_table(self):
+        """
+        Columnar InstanceTable of every instance in the library, for queries
+        over all placements. Built the first time and then cached.
+        """
+        if self._table is None or self._table[0] is not self.symbols or \
+           self._table[1] != len(self.symbols):
+            with self.stats.phase('table') as record:
+                table = InstanceTable(self.symbols)
+                record['items'] = len(table)
+
+            self._table = (self.symbols, len(self.symbols), table)
+
+        return self._table[2]
+
+    dependencies = property(_get_dependencies)
+
+
+def _resolve(symbols):
+    # Compute dependencies of given symbols (and everything they reach)
+    known = lambda symbol: symbol._depcache
+    for symbol, deps in closures(symbols, Symbol._children, known).iteritems():
+        symbol._depcache = deps
+
 
 ENTITIES_FIX = (':', '<', '>')
+def _refname(name):
+    # Library name of a libraryItemName reference: ":", "<" and ">" are not
+    # used as they are in library file names
+    for char in ENTITIES_FIX:
+        name = name.replace(char, "&#%d" % ord(char))
+
+    return name
+
+def _rename_refs(xml, names):
+    # Rewrite libraryItemName references to symbols in names (library name
+    # -> new library name) in a single pass over symbol XML
+    def rename(match):
+        name = _refname(unescape(match.group(1), {'&quot;': '"'}))
+        if name not in names:
+            return match.group(0)
+
+        ref = names[name]
+        for char in ENTITIES_FIX:
+            ref = ref.replace("&#%d" % ord(char), char)
+
+        return 'libraryItemName=%s' % quoteattr(ref)
+
+    return LIBRARY_REF.sub(rename, xml) if names else xml
+
+def _normalize_symbol(xml):
+    # Symbol XML without the attributes identifying it: name, itemID and
+    # lastModified on its root tag and its timeline name
+    strip = lambda match: SYMBOL_ID_ATTRS.sub('', match.group(0))
+    xml = SYMBOL_TAG.sub(strip, xml.replace('\r\n', '\n'), 1)
+    return TIMELINE_TAG.sub(strip, xml, 1)
+
+LIBRARY_REF = re.compile(u'libraryItemName="([^"]*)"')
+SYMBOL_TAG = re.compile(u'<DOMSymbolItem.*?>', re.S)
+TIMELINE_TAG = re.compile(u'<DOMTimeline.*?>', re.S)
+SYMBOL_ID_ATTRS = re.compile(u'\\s(?:name|itemID|lastModified)="[^"]*"')
 class Symbol(object):
     """
     Symbol representation (This is created using actual symbol XML file)
     and reference tag fro DOMDocument.xml
     """
 
-    def __init__(self, tag, symbols, directory):
+    __slots__ = ('_symbols', '_dom', '_meta', '_stream', '_compact',
+                 '_names', '_depcache', '_instances', '_linkage', 'attrs',
+                 'name', 'xml', 'archive', 'member')
+
+    def __init__(self, tag, symbols, directory, lazy=False, archive=None,
+                 meta=None, scan=False, compact=False, names=None):
         self._symbols = symbols
+        self._names = names
+        self._dom = None
+        self._meta = meta
+        self._stream = scan
+        self._compact = compact
         self._depcache = None
         self._instances = None
         self._linkage = None
@@ -252,13 +997,62 @@ class Symbol(object):
 
         # Get xml filename and remove extension
         self.name = _unicode(os.path.basename(tag['href'])[:-4])
-        self.xml = "%s/LIBRARY/%s" % (directory, tag['href'])
+        self.xml = "%s/LIBRARY/%s" % (directory,
+                                      _unicode(tag['href']).encode('utf-8'))
+
+        # Symbols read from a zip archive are only written to xml path once
+        # they are modified
+        self.archive = archive
+        self.member = "LIBRARY/%s" % tag['href']
+
+        if meta is not None:
+            # Metadata was already scanned from an existing file
+            pass
+        elif archive is not None:
+            if self.member not in archive:
+                raise IOError("Symbol file %s does not exist" % self.member)
+        else:
+            if not os.path.isfile(self.xml):
+                raise IOError("Symbol file %s does not exist" % self.xml)
+
+        if not lazy and meta is None:
+            self._scan() if scan or compact else self._get_dom()
+
+    def _get_dom(self):
+        # Parse symbol XML file the first time it's needed
+        if self._dom is None:
+            self._dom = _parse_symbol(self._read())
+
+        return self._dom
+
+    def _scan(self):
+        # Symbol root attributes and instances references
+        if self._meta is None:
+            if self._dom is None and self._stream:
+                self._meta = _iterscan(self._open())
+            else:
+                self._meta = _scan_dom(self.dom)
+
+            # Compact symbols keep just the metadata, dom is parsed again
+            # only if it's asked for
+            if self._compact:
+                self._dom = None
 
-        # Fix filesystem encoding
-        fixencoding(self.xml)
+        return self._meta
 
-        self.dom = fromstring(open(self.xml).read())
-        self.dom.attrib['xmlns'] = self.dom.tag.split('}')[0][1:]
+    def _read(self):
+        # Get raw symbol XML, from its archive if it was not modified yet
+        if self.archive is not None:
+            return self.archive.read(self.member)
+
+        return open(self.xml).read()
+
+    def _open(self):
+        # Same as _read, but returning a file-like object
+        if self.archive is not None:
+            return self.archive.open(self.member)
+
+        return open(self.xml)
 
     def to_xml(self):
         return _tag_from_dict("Include", self.attrs)
@@ -266,11 +1060,8 @@ class Symbol(object):
     def _get_linkage(self):
         if self._linkage: return self._linkage
 
-        if 'linkageClassName' not in self.dom.attrib:
-            self._linkage = None
-        else:
-            self._linkage = self.dom.attrib['linkageClassName']
-
+        attrib = self._scan()[0]
+        self._linkage = attrib.get('linkageClassName')
         return self._linkage
 
     def __str__(self):
@@ -286,10 +1077,16 @@ class Symbol(object):
         tag = _tag_from_dict('DOMSymbolItem', self.dom.attrib, 
                              terminate=False)
         newxml = re.sub(u'<DOMSymbolItem.*?>', tag, 
-                        open(self.xml).read().decode('utf-8'))
+                        self._read().decode('utf-8'))
+
+        # Save xml (Creating its directory for not extracted symbols). A new
+        # file is written, as it could be sharing data with other copies
+        if not os.path.isdir(os.path.dirname(self.xml)):
+            os.makedirs(os.path.dirname(self.xml))
 
-        # Save xml
-        open(self.xml, 'w').write(newxml.encode('utf-8'))
+        fwrite(self.xml, newxml.encode('utf-8'))
+        self.archive = None
+        self._meta = None
 
         # This flag is used to make the linkage loaded at Flash IDE boot time
         if 'loadImmediate' in self.attrs:
@@ -297,49 +1094,42 @@ class Symbol(object):
 
         self._linkage = name
 
-    def _dependencies(self):
-        if self._depcache == None:
-            self._depcache = set()
+    def _children(self):
+        # Resolve instances references into Symbol objects (Done only once)
+        if self._instances is None:
             self._instances = []
-            ns = self.dom.attrib['xmlns']
-
-            # Iterate through dependencies and set up needed properties
-            for ttimeline in self.dom.getiterator("{%s}DOMTimeline" % ns):
-                for tlayer in ttimeline.getiterator("{%s}DOMLayer" % ns):
-                    for tframe in tlayer.getiterator("{%s}DOMFrame" % ns):
-                        tagname = "{%s}DOMSymbolInstance" % ns
-                        for tsymb in tframe.getiterator(tagname):
-                            # Fix "<" and ">" characters from xml
-                            name = tsymb.attrib['libraryItemName']
-
-                            for char in ENTITIES_FIX:
-                                name = name.replace(char, "&#%d" % ord(char))
-
-                            # Get Symbol instance from FLA Object
-                            symbol = self._symbols[name]
-                            instance = SymbolInstance(
-                                symbol=symbol, name=tsymb.attrib["name"],
-                                frame=tframe.attrib["index"],
-                                layer=tlayer.attrib["name"],
-                                timeline=ttimeline.attrib["name"]
-                            )
-
-                            self._instances.append(instance)
-                            self._depcache.add(symbol)
-                            self._depcache = self._depcache.union(
-                                    symbol.dependencies)
-        
+            names = self._names if self._names is not None else {}
+            for ref in self._scan()[1]:
+                # Get Symbol instance from FLA Object, skipping references to
+                # symbols which files doesn't exist
+                symbol = self._symbols.get(_refname(ref[0]))
+                if symbol is None:
+                    continue
+
+                self._instances.append(SymbolInstance(
+                    symbol=symbol, name=_intern(names, ref[1]), frame=ref[2],
+                    layer=_intern(names, ref[3]),
+                    timeline=_intern(names, ref[4]), parent=self))
+
+        return [instance.symbol for instance in self._instances]
+
+    def _dependencies(self):
+        if self._depcache is None:
+            # Closures of every symbol reached are computed in the same pass
+            _resolve([self])
+
         return self._depcache
 
-    def _instances(self):
-        if self._instances == None:
-            self._dependencies()
+    def _get_instances(self):
+        if self._instances is None:
+            self._children()
 
         return self._instances
 
+    dom = property(_get_dom)
     linkage = property(_get_linkage, _set_linkage)
     dependencies = property(_dependencies)
-    instances = property(_instances)
+    instances = property(_get_instances)
 
 
 class SymbolInstance(object):
@@ -347,8 +1137,11 @@ class SymbolInstance(object):
     This object represents an instance found in a timeline for a given symbol
     """
 
-    def __init__(self, symbol, name, frame, layer, timeline):
+    __slots__ = ('symbol', 'parent', 'name', 'frame', 'layer', 'timeline')
+
+    def __init__(self, symbol, name, frame, layer, timeline, parent=None):
         self.symbol = symbol
+        self.parent = parent
         self.name = _unicode(name)
         self.frame = int(frame) + 1
         self.layer = _unicode(layer)
@@ -1 +1,2 @@
-from FLA import FLA, InvalidFLAFile, Symbol
+from FLA import FLA, InvalidFLAFile, SymbolConflict, Symbol
+from stats import Stats
@@ -0,0 +1,47 @@
+"""
+Persistent cache of parsed symbols metadata
+
+Symbols root attributes and instances references are stored on a SQLite
+database, keyed by the zip member CRC32 and size. So an unchanged member is
+never parsed again and a changed one just misses the cache.
+"""
+
+import os
+import json
+import sqlite3
+
+CACHE_FILE = 'pyfla-cache.sqlite'
+
+
+class ParseCache(object):
+    """
+    ParseCache could be shared between processes, given directory is created
+    as needed.
+    """
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(os.path.join(directory, CACHE_FILE),
+                                  timeout=60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS symbols ('
+                        'crc INTEGER, size INTEGER, meta TEXT, '
+                        'PRIMARY KEY (crc, size))')
+
+    def get(self, crc, size):
+        # Get (attributes, references) for given member or None
+        row = self.db.execute('SELECT meta FROM symbols WHERE crc=? AND '
+                              'size=?', (crc, size)).fetchone()
+        if row is None:
+            return None
+
+        attrib, refs = json.loads(row[0])
+        return attrib, [tuple(ref) for ref in refs]
+
+    def set(self, crc, size, meta):
+        self.db.execute('INSERT OR REPLACE INTO symbols VALUES (?, ?, ?)',
+                        (crc, size, json.dumps(meta)))
+
+    def commit(self):
+        self.db.commit()
@@ -1,10 +1,32 @@
 import os, sys
+import errno
+import itertools
+import mmap
 import shutil
-import subprocess
+import struct
+import tempfile
+import threading
+import time
 import unicodedata
 import zipfile
+import zlib
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
 
-BACKPORT_UNZIP = '/opt/local/bin/unzip -o -d %s "%s"'
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Media files already compressed, stored as they are when zipping
+STORED_EXTENSIONS = ('.dat', '.png', '.jpg', '.jpeg', '.gif', '.mp3', '.flv',
+                     '.f4v', '.swf', '.swc', '.zip')
+
+# Size of the chunks files are streamed in
+CHUNK_SIZE = 64 * 1024
+
+# Linux ioctl to clone a file sharing its extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
 
 def normalize(value):
     if isinstance(value, str):
@@ -13,49 +35,713 @@ def normalize(value):
     value = unicodedata.normalize("NFC", value).encode('utf-8')
     return value
 
-def fzip(filename, path):
-    # Compress FLA file using zipfile python library
-    os.chdir(path)
+def namekey(value):
+    # Lookup key of a file name: NFC normalized and lower-cased unicode
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+
+    return unicodedata.normalize("NFC", value).lower()
+
+class PathIndex(object):
+    """
+    Files and directories under root, walked only once. Paths are looked up
+    by their normalized, case-insensitive name (see namekey) and mapped to
+    the name they have on disk and to the NFC name they are zipped with.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.paths = {}
+        self.names = {}
+        for parent, dirs, files in os.walk(root):
+            for name in dirs + files:
+                self.add(os.path.relpath(os.path.join(parent, name), root))
+
+    def add(self, path):
+        self.paths.setdefault(namekey(path), path)
+        self.names[path] = normalize(path)
+
+    def resolve(self, path):
+        # Get path as it is on disk (relative to root) or None
+        return self.paths.get(namekey(path))
+
+    def arcname(self, path):
+        if path not in self.names:
+            self.names[path] = normalize(path)
+
+        return self.names[path]
+
+class ZipArchive(object):
+    """
+    Read-only view of a zip file (a path or a seekable file object).
+    Members are read straight from the archive (looked up by their
+    normalized name, falling back to a case-insensitive match) without
+    extracting anything to disk.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.zip = zipfile.ZipFile(filename)
+        self.lock = threading.Lock()
+        self.members = {}
+        self.folded = {}
+        for info in self.zip.infolist():
+            self.members[normalize(info.filename)] = info
+            self.folded.setdefault(namekey(info.filename), info)
+
+    def __contains__(self, name):
+        return normalize(name) in self.members or namekey(name) in self.folded
+
+    def namelist(self):
+        return self.members.keys()
+
+    def getinfo(self, name):
+        key = normalize(name)
+        if key in self.members:
+            return self.members[key]
+
+        return self.folded[namekey(name)]
+
+    def crc(self, name):
+        return self.getinfo(name).CRC
+
+    def read(self, name):
+        return self.zip.read(self.getinfo(name))
+
+    def open(self, name):
+        return self.zip.open(self.getinfo(name))
+
+    def read_raw(self, name):
+        # Get member compressed bytes, skipping its local file header. The
+        # file is opened again for every read (as ZipFile.open does), or
+        # the file object is locked, so members could be copied from many
+        # threads at once.
+        info = self.getinfo(name)
+        if not isinstance(self.filename, basestring):
+            with self.lock:
+                return self._read_raw(self.zip.fp, info)
+
+        with open(self.filename, 'rb') as fp:
+            return self._read_raw(fp, info)
+
+    def _read_raw(self, fp, info):
+        fp.seek(info.header_offset)
+        header = fp.read(zipfile.sizeFileHeader)
+        if header[0:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipfile("Bad magic number for file header")
+
+        header = struct.unpack(zipfile.structFileHeader, header)
+        fp.seek(header[zipfile._FH_FILENAME_LENGTH] +
+                header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+        return fp.read(info.compress_size)
+
+    def extract(self, name, target):
+        # Write member into target file
+        fwrite(target, self.read(name))
+
+    def copy(self, name, myzip, arcname, level=None):
+        """
+        Copy member into myzip (a writable ZipFile) without decompressing and
+        compressing it again (so level is not used).
+        """
+        info = self.getinfo(name)
+        zinfo = zipfile.ZipInfo(arcname, info.date_time)
+        zinfo.compress_type = info.compress_type
+        zinfo.external_attr = info.external_attr
+
+        if info.flag_bits & 0x01:
+            # Encrypted members cannot be copied as they are
+            myzip.writestr(zinfo, self.read(name))
+            return
+
+        zinfo.CRC = info.CRC
+        zinfo.file_size = info.file_size
+        write_raw(myzip, zinfo, self.read_raw(name))
+
+class DirectoryArchive(object):
+    """
+    Read-only view of a directory (an uncompressed XFL) with the ZipArchive
+    interface, so its files are used in place. Members are looked up by
+    their normalized, case-insensitive name (see PathIndex).
+    """
+
+    def __init__(self, root):
+        self.filename = root
+        self.index = PathIndex(root)
+        self.members = dict((self.index.arcname(path), path) \
+            for path in self.index.names \
+                if os.path.isfile(os.path.join(root, path)))
+
+    def path(self, name):
+        # Member file path or None
+        path = self.index.resolve(name)
+        if path is None or self.index.arcname(path) not in self.members:
+            return None
+
+        return os.path.join(self.filename, path)
+
+    def __contains__(self, name):
+        return self.path(name) is not None
+
+    def namelist(self):
+        return self.members.keys()
+
+    def getinfo(self, name):
+        # Member date and sizes, its CRC is not known (see crc)
+        path = self.path(name)
+        if path is None:
+            raise KeyError("There is no item named %r in the directory" % name)
+
+        st = os.stat(path)
+        info = zipfile.ZipInfo(normalize(name),
+                               time.localtime(st.st_mtime)[:6])
+        info.file_size = info.compress_size = st.st_size
+        return info
+
+    def crc(self, name):
+        # Member CRC, reading its file in chunks
+        crc = 0
+        with self.open(name) as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                crc = zlib.crc32(chunk, crc)
+
+        return crc & 0xffffffff
+
+    def read(self, name):
+        return self.open(name).read()
+
+    def open(self, name):
+        path = self.path(name)
+        if path is None:
+            raise KeyError("There is no item named %r in the directory" % name)
+
+        return open(path, 'rb')
+
+    def extract(self, name, target):
+        # Write member into target file, sharing its data only through a
+        # reflink: a hardlink would be changed along with this directory
+        path = self.path(name)
+        if os.path.exists(target) and os.path.samefile(path, target):
+            return
+
+        fclone(path, target, link=False)
+
+    def copy(self, name, myzip, arcname, level=None):
+        # Compress member into myzip (a writable ZipFile) with given zlib
+        # level, or store it (see fzip)
+        _write_file(myzip, self.path(name), arcname, _level(name, level))
+
+def write_raw(myzip, zinfo, data):
+    # Write an already compressed member (zinfo has its CRC, file_size and
+    # compress_type) into myzip, a writable ZipFile
+    zinfo.compress_size = len(data)
+    zinfo.header_offset = myzip.fp.tell()
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or \
+            zinfo.compress_size > zipfile.ZIP64_LIMIT
+
+    myzip._writecheck(zinfo)
+    myzip._didModify = True
+    myzip.fp.write(zinfo.FileHeader(zip64))
+    myzip.fp.write(data)
+    myzip.filelist.append(zinfo)
+    myzip.NameToInfo[zinfo.filename] = zinfo
+
+def seekable(fileobj):
+    # Whether given file object supports tell() and seek()
+    try:
+        fileobj.seek(fileobj.tell())
+    except (AttributeError, IOError, ValueError):
+        return False
+
+    return True
+
+class ZipStream(object):
+    """
+    Write-only file object counting its position, so zipfile could write
+    into streams without tell() or seek() (sockets, pipes, responses)
+    """
+
+    streaming = True
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.position = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        if hasattr(self.fileobj, 'flush'):
+            self.fileobj.flush()
+
+class ZipMember(object):
+    """
+    File-like object writing a new member into myzip (a ZipFile open for
+    writing), deflating data with given zlib level as it's written (stored
+    when level is None). Its header is completed once closed (or a data
+    descriptor is written after it, on a ZipStream), so the member is never
+    held in memory. Its date and mode are taken from st (the os.stat of a
+    file) when given.
+    """
+
+    def __init__(self, myzip, arcname, level=zlib.Z_DEFAULT_COMPRESSION,
+                 st=None):
+        self.zip = myzip
+        if st is not None:
+            self.info = _zipinfo(arcname, level, st, 0, 0)
+        else:
+            self.info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+            self.info.compress_type = zipfile.ZIP_STORED if level is None \
+                                          else zipfile.ZIP_DEFLATED
+            self.info.external_attr = 0644 << 16L
+
+        self.info.file_size = self.info.compress_size = self.info.CRC = 0
+        self.info.header_offset = myzip.fp.tell()
+        self.streaming = getattr(myzip.fp, 'streaming', False)
+        if self.streaming:
+            self.info.flag_bits |= 0x08
+
+        myzip._writecheck(self.info)
+        myzip._didModify = True
+        myzip.fp.write(self.info.FileHeader(False))
+
+        self.compressor = None
+        if self.info.compress_type == zipfile.ZIP_DEFLATED:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        self.info.CRC = zlib.crc32(data, self.info.CRC) & 0xffffffff
+        self.info.file_size += len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+
+        self.info.compress_size += len(data)
+        self.zip.fp.write(data)
+
+    def close(self):
+        if self.compressor is not None:
+            data = self.compressor.flush()
+            self.info.compress_size += len(data)
+            self.zip.fp.write(data)
+
+        if self.info.file_size > zipfile.ZIP64_LIMIT or \
+           self.info.compress_size > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile("Streamed member is too large")
+
+        if self.streaming:
+            # Final CRC and sizes go after the data
+            self.zip.fp.write(struct.pack('<4sLLL', 'PK\x07\x08',
+                                          self.info.CRC,
+                                          self.info.compress_size,
+                                          self.info.file_size))
+        else:
+            # Rewrite its header with the final CRC and sizes
+            position = self.zip.fp.tell()
+            self.zip.fp.seek(self.info.header_offset)
+            self.zip.fp.write(self.info.FileHeader(False))
+            self.zip.fp.seek(position)
+
+        self.zip.filelist.append(self.info)
+        self.zip.NameToInfo[self.info.filename] = self.info
 
-    tree = list(os.walk('.'))
-    myzip = zipfile.ZipFile(filename, 'w')
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _compress(name, level):
+    # Read and deflate a file with given level returning (stat, CRC, size,
+    # data). Run on pool threads, zlib releases the GIL while compressing.
+    st = os.stat(name)
+    with open(name, 'rb') as f:
+        data = f.read()
+
+    crc = zlib.crc32(data) & 0xffffffff
+    size = len(data)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return st, crc, size, compressor.compress(data) + compressor.flush()
+
+def _write_file(myzip, name, arcname, level):
+    # Stream a file into myzip in chunks, deflated with given level or
+    # stored when level is None (see ZipMember)
+    with open(name, 'rb') as f:
+        with ZipMember(myzip, arcname, level, os.fstat(f.fileno())) as member:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                member.write(chunk)
+
+def _level(name, level):
+    # Compression level of a file: media already compressed is stored
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        return None
+
+    return level
+
+def _zipinfo(arcname, level, st, crc, size):
+    # ZipInfo of a file compressed by _compress
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+    zinfo.compress_type = zipfile.ZIP_STORED if level is None \
+                              else zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    return zinfo
+
+def fzip(filename, path, members=(), index=None, generated=(), level=None,
+         workers=None):
+    # Compress FLA file using zipfile python library into filename, a path
+    # or a file object (which could be a non seekable stream). Generated is
+    # an iterable of (arcname, chunks) written first, streaming its chunks
+    # (strings) into the zip. Members is an iterable of (archive, name,
+    # arcname) which are copied as they are (Already compressed) from given
+    # archives. Files or members with an arcname already written
+    # (case-insensitive) are skipped. Files are zipped with their NFC name,
+    # taken from index (PathIndex of path) when given. Returns the number of
+    # members written.
+    #
+    # New members are deflated with given zlib level (1 fastest to 9 best)
+    # or stored when level is None, as media already compressed
+    # (STORED_EXTENSIONS) always are. Files are streamed in chunks, or
+    # compressed using a pool of given number of threads (at most twice
+    # that number of files at once) and written in order.
+    #
+    # A zip file is written aside and renamed over filename once complete,
+    # as filename could be one of the archives members are copied from.
+    if isinstance(filename, basestring):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(
+                                           os.path.abspath(filename)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                written = fzip(f, path, members, index, generated, level,
+                               workers)
+
+            os.chmod(tmp, 0644)
+            os.rename(tmp, filename)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        return written
+
+    tree = list(os.walk(path))
+    written = set()
+    arcname = index.arcname if index is not None else normalize
+    if not seekable(filename):
+        filename = ZipStream(filename)
+
+    myzip = zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED \
+                                if level is None else zipfile.ZIP_DEFLATED)
+    for name, chunks in generated:
+        # XFL (as ODF) containers mimetype must be stored
+        mlevel = None if name == 'mimetype' else level
+        with ZipMember(myzip, normalize(name), mlevel) as member:
+            for chunk in chunks:
+                member.write(chunk)
+
+        written.add(namekey(name))
+
+    jobs = []
     for parent, dirs, files in tree:
         for file in files:
-            myzip.write('%s/%s' % (parent, normalize(file)))
+            name = os.path.relpath(os.path.join(parent, file), path)
+            if namekey(name) in written:
+                continue
+
+            written.add(namekey(name))
+            jobs.append((name, _level(name, level)))
+
+    pool = None
+    if workers and workers > 1 and level is not None and len(jobs) > 1:
+        pool = ThreadPool(workers)
+
+    def write(name, jlevel, result):
+        if result is None:
+            _write_file(myzip, os.path.join(path, name), arcname(name),
+                        jlevel)
+        else:
+            result = result.get()
+            write_raw(myzip, _zipinfo(arcname(name), jlevel, *result[:3]),
+                      result[3])
+
+    try:
+        # Files are compressed ahead on a sliding window, the others are
+        # streamed when their turn comes
+        pending = deque()
+        for name, jlevel in jobs:
+            result = None
+            if pool is not None and jlevel is not None:
+                result = pool.apply_async(_compress,
+                                          (os.path.join(path, name), jlevel))
+
+            pending.append((name, jlevel, result))
+            if pool is None or len(pending) >= workers * 2:
+                write(*pending.popleft())
+
+        while pending:
+            write(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for archive, name, arcname in members:
+        if namekey(arcname) in written:
+            continue
+
+        archive.copy(name, myzip, normalize(arcname), level)
+        written.add(namekey(arcname))
 
     myzip.close()
+    return len(written)
+
+def fxfl(directory, path, members=(), index=None, generated=()):
+    # Write an uncompressed XFL into directory (created as needed), the same
+    # way fzip does: generated (arcname, chunks) files first, then files
+    # under path and finally (archive, name, arcname) members. Returns the
+    # number of files written.
+    written = set()
+    arcname = index.arcname if index is not None else normalize
+
+    def target(name):
+        target = os.path.join(directory, name)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+
+        written.add(namekey(name))
+        return target
+
+    for name, chunks in generated:
+        fwrite(target(normalize(name)), chunks)
+
+    for parent, dirs, files in os.walk(path):
+        for file in files:
+            name = os.path.relpath(os.path.join(parent, file), path)
+            if namekey(name) not in written:
+                fclone(os.path.join(path, name), target(arcname(name)))
+
+    for archive, name, arcname in members:
+        if namekey(arcname) not in written:
+            archive.extract(name, target(normalize(arcname)))
+
+    return len(written)
+
+def fclone(src, dst, link=True):
+    """
+    Copy src file into dst sharing its data when possible: a reflink (copy on
+    write clone) first, then a hardlink (unless link is False) and finally a
+    regular copy. Hardlinked files must be written using fwrite to not
+    modify both copies.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as fsrc:
+                with open(dst, 'wb') as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except (IOError, OSError):
+            if os.path.lexists(dst):
+                os.remove(dst)
 
-def funzip(filename, path):
-    # Extract FLA file inside a temporary directory trying default 
-    # python zip library, if doesn't work try unzip
     try:
-        zf = zipfile.ZipFile(filename)
-        zf.extractall(path=path)
-    except (zipfile.BadZipfile, IOError):
-        shutil.rmtree(path)
-        run = BACKPORT_UNZIP % (path, filename)
-        proc = subprocess.Popen(run, shell=True, stderr=subprocess.PIPE, 
-                                stdout=subprocess.PIPE)
-        out = proc.stdout.read()
-        proc.wait()
+        if not link:
+            raise OSError("Hardlinks are not allowed")
+
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copy(src, dst)
 
-def fixencoding(path):
+def fwrite(path, data):
     """
-    Fix filenames and directories with a wrong encoding. This behavoir is there
-    because unzip is setting wrong the encoding.
+    Replace path contents with data (a string or an iterable of strings). A
+    new file is created and renamed over path, so files sharing data with it
+    (hardlinks) are left untouched.
     """
-    upath = unicode(path, 'utf-8') if isinstance(path, str) else path
-    path = upath.encode('utf-8')
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in [data] if isinstance(data, basestring) else data:
+            f.write(chunk)
+
+    os.chmod(tmp, 0644)
+    os.rename(tmp, path)
+
+def _local_header(fp, offset):
+    # Parse the local file header at given offset of fp (a file or mmap),
+    # returning (name, data offset, flags, compress type, compress size,
+    # CRC) or None if it's not a valid header of a member we could read
+    fp.seek(offset)
+    header = fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or \
+       header[0:4] != zipfile.stringFileHeader:
+        return None
 
-    encoded = unicodedata.normalize('NFKD', upath).encode('utf-8')
-    basedir = os.path.dirname(path)
-    # Create fixed directory names as needed
-    if not os.path.isdir(basedir):
-        os.makedirs(basedir)
+    header = struct.unpack(zipfile.structFileHeader, header)
+    flags = header[zipfile._FH_GENERAL_PURPOSE_FLAG_BITS]
+    compress_type = header[zipfile._FH_COMPRESSION_METHOD]
+    if flags & 0x01 or compress_type not in (zipfile.ZIP_STORED,
+                                             zipfile.ZIP_DEFLATED):
+        # Encrypted members or unknown compression are not supported
+        return None
 
-    # Create fixed file names as needed
-    if not os.path.isfile(encoded):
-        encoded = "%s/%s" % (os.path.dirname(encoded), os.path.basename(path))
+    name = fp.read(header[zipfile._FH_FILENAME_LENGTH])
+    start = offset + zipfile.sizeFileHeader + len(name) + \
+            header[zipfile._FH_EXTRA_FIELD_LENGTH]
+    return name, start, flags, compress_type, \
+           header[zipfile._FH_COMPRESSED_SIZE], header[zipfile._FH_CRC]
 
-    if encoded != path and not os.path.isfile(path):
-        shutil.copy(encoded, path)
+def _descriptor_size(data, start, compress_type):
+    # (compress size, CRC) of a member followed by a data descriptor (its
+    # local header does not know them), or None if its end is not found
+    if compress_type == zipfile.ZIP_DEFLATED:
+        # Deflate streams know where they end
+        decompressor = zlib.decompressobj(-15)
+        crc, pos = 0, start
+        try:
+            while pos < len(data):
+                chunk = data[pos:pos + 65536]
+                crc = zlib.crc32(decompressor.decompress(chunk), crc)
+                if decompressor.unused_data:
+                    size = pos + len(chunk) - len(decompressor.unused_data)
+                    return size - start, crc & 0xffffffff
+
+                pos += len(chunk)
+        except zlib.error:
+            return None
+
+        return None
+
+    # Stored data ends where a descriptor holding its size is found
+    pos = data.find('PK\x07\x08', start)
+    while pos >= 0:
+        crc, size = struct.unpack('<LL', data[pos + 4:pos + 12])
+        if size == pos - start:
+            return size, crc
+
+        pos = data.find('PK\x07\x08', pos + 4)
+
+    return None
+
+def scan_headers(filename):
+    """
+    Members of a zip file found scanning its local file headers (when its
+    central directory is damaged or missing), as (name, header offset,
+    compress type, compress size, CRC) tuples
+    """
+    if not os.path.getsize(filename):
+        return []
+
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    members = []
+    try:
+        offset = data.find(zipfile.stringFileHeader)
+        while offset >= 0:
+            end = offset + 4
+            header = _local_header(data, offset)
+            if header is not None:
+                name, start, flags, compress_type, size, crc = header
+                if flags & 0x08:
+                    size, crc = _descriptor_size(data, start, compress_type) \
+                                    or (None, None)
+
+                if size is not None and start + size <= len(data):
+                    members.append((name, offset, compress_type, size, crc))
+                    end = start + size
+
+            offset = data.find(zipfile.stringFileHeader, end)
+    finally:
+        data.close()
+
+    return members
+
+def zip_members(filename):
+    """
+    Members of a zip file (see scan_headers) from its central directory, or
+    scanning its local file headers if it cannot be read
+    """
+    try:
+        infos = zipfile.ZipFile(filename).infolist()
+    except (zipfile.BadZipfile, IOError):
+        if not os.path.isfile(filename):
+            return []
+
+        return scan_headers(filename)
+
+    return [(info.filename, info.header_offset, info.compress_type,
+             info.compress_size, info.CRC) for info in infos]
+
+def _extract(job):
+    # Extract a member into path returning its name, or None if it's
+    # damaged. Run on pool threads, zlib releases the GIL while
+    # decompressing.
+    filename, path, (name, offset, compress_type, size, crc) = job
+    parts = [part for part in name.split('/') if part not in ('', '.', '..')]
+    if not parts:
+        return None
+
+    target = os.path.join(path, *parts)
+    try:
+        if name.endswith('/'):
+            os.makedirs(target)
+            return name
+
+        os.makedirs(os.path.dirname(target))
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    with open(filename, 'rb') as f:
+        header = _local_header(f, offset)
+        if header is None:
+            return None
+
+        f.seek(header[1])
+        data = f.read(size)
+
+    try:
+        if compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -15)
+    except zlib.error:
+        return None
+
+    if zlib.crc32(data) & 0xffffffff != crc:
+        return None
+
+    with open(target, 'wb') as f:
+        f.write(data)
+
+    return name
+
+def funzip(filename, path, workers=None):
+    """
+    Extract zip file inside path. Members are listed from its central
+    directory or, if it's damaged, scanning local file headers, and
+    damaged members are skipped. Members are decompressed using a pool of
+    given number of threads. Returns the number of members extracted.
+    """
+    # Members found more than once (appended archives) are extracted once
+    members = OrderedDict((member[0], member) \
+                              for member in zip_members(filename))
+    jobs = [(filename, path, member) for member in members.itervalues()]
+
+    pool = None
+    if workers and workers > 1 and len(jobs) > 1:
+        pool = ThreadPool(workers)
+
+    try:
+        imap = pool.imap if pool else itertools.imap
+        return sum(1 for name in imap(_extract, jobs) if name is not None)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -0,0 +1,72 @@
+"""
+Library folders of a FLA file
+"""
+
+import os
+from collections import OrderedDict
+from hashlib import md5
+
+
+def itemid(path):
+    # Flash library item ID for given folder path
+    uid = md5(path.encode('utf-8')).hexdigest()
+    return "0000%s-0000%s" % (uid[:4], uid[4:8])
+
+
+class Folders(OrderedDict):
+    """
+    Ordered mapping of folder path -> {'name': path, 'itemID': id}, which is
+    also a folder tree: every path keeps track of its direct subfolders.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._children = {}
+        OrderedDict.__init__(self, *args, **kwargs)
+
+    def __setitem__(self, path, value):
+        if path not in self:
+            parent = os.path.dirname(path)
+            self._children.setdefault(parent, set()).add(path)
+
+        OrderedDict.__setitem__(self, path, value)
+
+    def __delitem__(self, path):
+        OrderedDict.__delitem__(self, path)
+        parent = os.path.dirname(path)
+        self._children[parent].discard(path)
+        if not self._children[parent]:
+            del self._children[parent]
+
+    def add(self, path):
+        """
+        Add folder path and its missing parent folders (parents first).
+        Folders already added are left untouched, so their itemID is
+        computed only once.
+        """
+        missing = []
+        while path and path not in self:
+            missing.append(path)
+            path = os.path.dirname(path)
+
+        for path in reversed(missing):
+            self[path] = {'name': path, 'itemID': itemid(path)}
+
+    def children(self, path=''):
+        """
+        Direct subfolders of given folder (top level folders by default)
+        """
+        return sorted(self._children.get(path, ()))
+
+    def remove(self, path):
+        """
+        Remove given folder and all its subfolders, returning removed paths
+        """
+        removed = []
+        for child in self.children(path):
+            removed.extend(self.remove(child))
+
+        if path in self:
+            del self[path]
+            removed.append(path)
+
+        return removed
@@ -0,0 +1,104 @@
+"""
+Dependency graph helpers
+
+Graphs are given as a children(node) function, so they could be walked without
+building them upfront. Everything is iterative, deep or cyclic graphs are fine.
+"""
+
+
+def components(nodes, children, skip=None):
+    """
+    Yield strongly connected components (lists of nodes) reachable from given
+    nodes using Tarjan's algorithm. Components are yielded in reverse
+    topological order: every component comes after all the components it
+    depends on. Nodes for which skip(node) is True are not visited.
+    """
+    index, lowlink, onstack = {}, {}, set()
+    stack = []
+
+    for root in nodes:
+        if root in index or (skip and skip(root)):
+            continue
+
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(children(root)))]
+
+        while work:
+            node, childs = work[-1]
+            for child in childs:
+                if child not in index:
+                    if skip and skip(child):
+                        continue
+
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    onstack.add(child)
+                    work.append((child, iter(children(child))))
+                    break
+                elif child in onstack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onstack.discard(member)
+                        component.append(member)
+                        if member is node:
+                            break
+
+                    yield component
+
+
+def closures(nodes, children, known=None):
+    """
+    Compute the transitive closure (frozenset of every node reachable through
+    children) of given nodes, returning a dict for all the nodes visited.
+    known(node) could return an already computed closure (or None), those
+    nodes are not visited again. All nodes of a component share its closure.
+    """
+    result = {}
+    skip = (lambda n: known(n) is not None) if known else None
+    closure = lambda n: result[n] if n in result else known(n)
+
+    for component in components(nodes, children, skip):
+        # A cycle, the whole component depends on itself (a single node
+        # only when it has an edge to itself, added below)
+        members = set(component)
+        deps = set(members) if len(component) > 1 else set()
+        for node in component:
+            for child in children(node):
+                if child in members:
+                    deps.add(child)
+                elif child not in deps:
+                    deps.add(child)
+                    deps.update(closure(child))
+
+        deps = frozenset(deps)
+        for node in component:
+            result[node] = deps
+
+    return result
+
+
+def reachable(nodes, children):
+    """
+    Set of given nodes and every node reachable from them, visiting each node
+    and edge once.
+    """
+    seen = set(nodes)
+    work = list(seen)
+    while work:
+        for child in children(work.pop()):
+            if child not in seen:
+                seen.add(child)
+                work.append(child)
+
+    return seen
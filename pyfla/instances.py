@@ -0,0 +1,165 @@
+"""
+Columnar table of every symbol instance in a FLA
+
+Instances are stored column by column on integer arrays (symbol, parent,
+name, frame, layer and timeline), strings being replaced by ids into value
+lists. Queries over the whole library are then done with a single pass over
+a few arrays, vectorised when NumPy is installed:
+
+>>> table = fla.instance_table()
+>>> rows = table.select(symbol='Buttons/Play', layer='Layer 1',
+...                     frames=(1, 100))
+>>> table.count('parent', rows)
+{u'Screens/Main': 3, u'Screens/Pause': 1}
+"""
+
+from array import array
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS = ('symbol', 'parent', 'name', 'frame', 'layer', 'timeline')
+
+
+class InstanceTable(object):
+    """
+    Instances of given symbols (mapping of name -> Symbol). Every column is
+    an array of ids into values[column] (symbol and parent columns share
+    the library names list), but frame which holds frame numbers.
+    """
+
+    def __init__(self, symbols):
+        self.columns = dict((column, array('i')) for column in COLUMNS)
+        names = list(symbols)
+        self.values = {'symbol': names, 'parent': names, 'name': [],
+                       'layer': [], 'timeline': []}
+        self._ids = {'symbol': dict((name, i) for i, name in enumerate(names)),
+                     'name': {}, 'layer': {}, 'timeline': {}}
+        self._ids['parent'] = self._ids['symbol']
+
+        symbolids = self._ids['symbol']
+        columns = self.columns
+        for parent, symbol in enumerate(symbols.itervalues()):
+            for instance in symbol.instances:
+                child = symbolids.get(instance.symbol.attrs['href'][:-4])
+                if child is None:
+                    continue
+
+                columns['symbol'].append(child)
+                columns['parent'].append(parent)
+                columns['name'].append(self._add('name', instance.name))
+                columns['frame'].append(instance.frame)
+                columns['layer'].append(self._add('layer', instance.layer))
+                columns['timeline'].append(self._add('timeline',
+                                                     instance.timeline))
+
+        self._arrays = {}
+
+    def _add(self, column, value):
+        # Id of given string value, added to the column values if missing
+        ids = self._ids[column]
+        if value not in ids:
+            ids[value] = len(ids)
+            self.values[column].append(value)
+
+        return ids[value]
+
+    def __len__(self):
+        return len(self.columns['frame'])
+
+    def column(self, name):
+        """
+        Given column as a NumPy array (sharing the array data), or as the
+        plain array when NumPy is not available
+        """
+        if numpy is None:
+            return self.columns[name]
+
+        if name not in self._arrays:
+            data = self.columns[name]
+            self._arrays[name] = numpy.frombuffer(data,
+                                        dtype='i%d' % data.itemsize) \
+                                    if data else numpy.zeros(0, dtype=int)
+
+        return self._arrays[name]
+
+    def _idset(self, column, value):
+        # Ids of a value or a list of values (unknown values are ignored)
+        if isinstance(value, basestring):
+            value = [value]
+
+        ids = self._ids[column]
+        return set(ids[v] for v in value if v in ids)
+
+    def select(self, frames=None, **filters):
+        """
+        Row numbers of instances matching every given filter: column=value
+        (or list of values) for symbol, parent, name, layer and timeline,
+        and frames=(first, last) for frame numbers in that range.
+        """
+        for column in filters:
+            if column not in self._ids:
+                raise ValueError("Unknown column %r" % (column, ))
+
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            for column, value in filters.iteritems():
+                ids = list(self._idset(column, value))
+                mask &= numpy.in1d(self.column(column), ids)
+
+            if frames is not None:
+                frame = self.column('frame')
+                mask &= (frame >= frames[0]) & (frame <= frames[1])
+
+            return numpy.flatnonzero(mask)
+
+        rows = xrange(len(self))
+        for column, value in filters.iteritems():
+            ids, data = self._idset(column, value), self.columns[column]
+            rows = [i for i in rows if data[i] in ids]
+
+        if frames is not None:
+            first, last = frames
+            data = self.columns['frame']
+            rows = [i for i in rows if first <= data[i] <= last]
+
+        return list(rows)
+
+    def count(self, by, rows=None):
+        """
+        Group given rows (every row by default) by a column, returning a
+        dict of value -> number of instances
+        """
+        values = self.values.get(by)
+        if numpy is not None:
+            data = self.column(by)
+            if rows is not None:
+                data = data[rows]
+
+            counts = numpy.bincount(data) if len(data) else []
+            return dict((values[i] if values is not None else i, int(count)) \
+                            for i, count in enumerate(counts) if count)
+
+        data = self.columns[by]
+        counts = Counter(data[i] for i in rows) if rows is not None \
+                    else Counter(data)
+        if values is None:
+            return dict(counts)
+
+        return dict((values[i], count) for i, count in counts.iteritems())
+
+    def rows(self, rows=None):
+        """
+        Given rows (every row by default) as (symbol, parent, name, frame,
+        layer, timeline) tuples of values
+        """
+        if rows is None:
+            rows = xrange(len(self))
+
+        columns = [(self.columns[column], self.values.get(column)) \
+                       for column in COLUMNS]
+        return [tuple(data[i] if values is None else values[data[i]] \
+                          for data, values in columns) for i in rows]
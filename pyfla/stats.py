@@ -0,0 +1,82 @@
+"""
+Per-phase timing and counters
+
+Stats objects are opt-in, given to FLA.fromfile (or set as FLA.stats), and
+record how long each phase took and how many items and bytes it handled:
+
+>>> stats = Stats(callback=lambda phase, record: metrics.send(phase, record))
+>>> fla = FLA.fromfile('Element.fla', stats=stats)
+>>> fla.save('Copy.fla')
+>>> stats.as_dict()
+{'unzip': {'calls': 1, 'seconds': 0.02, 'items': 25, 'bytes': 20480}, ...}
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class Stats(object):
+    """
+    Accumulates per phase calls, seconds, items and bytes. After every phase
+    callback(phase, record) is called and a debug message is sent to logger
+    (both optional), record being a dict with that call figures.
+    """
+
+    def __init__(self, callback=None, logger=None):
+        self.callback = callback
+        self.logger = logger
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        # Time the block; it could fill items and bytes in yielded record
+        record = {'items': 0, 'bytes': 0}
+        start = time.time()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.time() - start
+            self.add(name, **record)
+
+    def add(self, name, seconds=0.0, items=0, bytes=0):
+        total = self.phases.setdefault(name, {'calls': 0, 'seconds': 0.0,
+                                              'items': 0, 'bytes': 0})
+        total['calls'] += 1
+        total['seconds'] += seconds
+        total['items'] += items
+        total['bytes'] += bytes
+
+        record = {'seconds': seconds, 'items': items, 'bytes': bytes}
+        if self.logger is not None:
+            self.logger.debug("%s: %.3fs, %d items, %d bytes", name, seconds,
+                              items, bytes)
+
+        if self.callback is not None:
+            self.callback(name, record)
+
+    def as_dict(self):
+        return dict((name, dict(total)) \
+                        for name, total in self.phases.iteritems())
+
+    def __str__(self):
+        return '\n'.join('%-16s %8.3fs %6d calls %8d items %10d bytes' % \
+                (name, t['seconds'], t['calls'], t['items'], t['bytes']) \
+                    for name, t in sorted(self.phases.iteritems()))
+
+
+class NullStats(object):
+    """
+    Stats doing nothing, used when no stats are requested
+    """
+
+    @contextmanager
+    def phase(self, name):
+        yield {'items': 0, 'bytes': 0}
+
+    def add(self, name, seconds=0.0, items=0, bytes=0):
+        pass
+
+    def as_dict(self):
+        return {}
+
+NULL_STATS = NullStats()
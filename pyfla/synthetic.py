@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic FLA generator
+
+Writes valid CS5 .fla files (using FLA.save, so the same DOMDocument template)
+with a configurable library shape, to be used as fixtures and benchmarks.
+
+>>> generate('Synthetic.fla', symbols=5000, depth=3, fanout=4, chain=5)
+"""
+
+import os
+import random
+from xml.sax.saxutils import quoteattr
+
+from FLA import FLA, Symbol
+from folders import itemid
+
+SYMBOL_TPL = u"""\
+<DOMSymbolItem xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xmlns="http://ns.adobe.com/xfl/2008/" name=%(name)s \
+itemID="%(itemid)s"%(linkage)s lastModified="1300000000">
+  <timeline>
+    <DOMTimeline name=%(timeline)s>
+      <layers>
+%(layers)s
+      </layers>
+    </DOMTimeline>
+  </timeline>
+</DOMSymbolItem>
+"""
+
+LAYER_TPL = u"""\
+        <DOMLayer name="Layer %(layer)d" color="#4FFF4F">
+          <frames>
+            <DOMFrame index="%(frame)d" keyMode="9728">
+              <elements>
+%(elements)s
+              </elements>
+            </DOMFrame>
+          </frames>
+        </DOMLayer>"""
+
+INSTANCE_TPL = u"""\
+                <DOMSymbolInstance libraryItemName=%(symbol)s \
+name="inst%(index)d">
+                  <matrix>
+                    <Matrix tx="%(index)d.5" ty="%(index)d.25"/>
+                  </matrix>
+                  <transformationPoint>
+                    <Point x="10" y="10"/>
+                  </transformationPoint>
+                </DOMSymbolInstance>"""
+
+SHAPE_TPL = u"""\
+                <DOMShape isFloating="true">
+                  <fills>
+                    <FillStyle index="1">
+                      <SolidColor color="#%(color)06X"/>
+                    </FillStyle>
+                  </fills>
+                  <edges>
+                    <Edge fillStyle1="1" \
+edges="!0 0|%(size)d 0|%(size)d %(size)d|0 %(size)d|0 0"/>
+                  </edges>
+                </DOMShape>"""
+
+UNICODE_NAMES = (u'Símbolo', u'Ñandú', u'Größe', u'Café', u'Ĳssel')
+
+
+def _names(symbols, depth, unicode_names, prefix):
+    # Library names spread over a folder tree of given depth
+    names = []
+    for i in range(symbols):
+        folders = ['Folder%d' % ((i / (4 ** level)) % 4) \
+                       for level in range(depth)]
+        base = '%sSymbol%d' % (prefix, i)
+        if unicode_names and i % 3 == 0:
+            base = u'%s%s %d' % (prefix, UNICODE_NAMES[i % len(UNICODE_NAMES)],
+                                 i)
+
+        names.append(u'/'.join(folders + [base]))
+
+    return names
+
+def generate(filepath, symbols=100, depth=2, fanout=3, chain=3,
+             unicode_names=False, layers=1, exported=0.1, prefix='', seed=0):
+    """
+    Write a .fla file with given number of symbols, spread over folders of
+    given depth. Symbols are split in chain + 1 levels, each one placing
+    fanout instances of symbols from the next level (so chain is the
+    dependencies depth). A fraction of symbols (exported) gets a linkage
+    class name. Symbols names start with prefix, so different libraries
+    could be generated to be merged.
+    """
+    rand = random.Random(seed)
+    names = _names(symbols, depth, unicode_names, prefix)
+    numbered = list(enumerate(names))
+    levels = [numbered[level::chain + 1] for level in range(chain + 1)]
+
+    fla = FLA(name=os.path.basename(filepath).split('.')[0])
+    for level, lnames in enumerate(levels):
+        for number, name in lnames:
+            children = levels[level + 1] if level < chain else []
+            elements = [SHAPE_TPL % {'color': rand.randint(0, 0xFFFFFF),
+                                     'size': rand.randint(10, 500)}]
+            for index in range(fanout if children else 0):
+                elements.append(INSTANCE_TPL % {
+                    'symbol': quoteattr(rand.choice(children)[1]),
+                    'index': index})
+
+            linkage = ''
+            if rand.random() < exported:
+                linkage = ' linkageExportForAS="true" ' \
+                          'linkageClassName="%sClass%d"' % (prefix, number)
+
+            xml = SYMBOL_TPL % {
+                'name': quoteattr(name), 'itemid': itemid(name),
+                'linkage': linkage,
+                'timeline': quoteattr(name.split('/')[-1]),
+                'layers': '\n'.join(LAYER_TPL % {
+                    'layer': layer + 1, 'frame': layer,
+                    'elements': '\n'.join(elements[layer::layers])
+                } for layer in range(layers))
+            }
+
+            path = os.path.join(fla.directory, 'LIBRARY',
+                                name.encode('utf-8') + '.xml')
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            open(path, 'w').write(xml.encode('utf-8'))
+            tag = {'href': name + '.xml', 'itemIcon': '1',
+                   'loadImmediate': 'false', 'itemID': itemid(name),
+                   'lastModified': '1300000000'}
+            fla.symbols[name] = Symbol(tag, fla.symbols, fla.directory,
+                                       lazy=True)
+            fla.folders.add(os.path.dirname(name))
+
+    fla.save(filepath)
+    return filepath